@@ -0,0 +1,96 @@
+import bisect
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Sentence-BERT encoders are expensive to load, so keep one per model name.
+# Async sessions encode in worker threads, so loading is guarded by a lock.
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model_name: str):
+    encoder = _encoders.get(model_name)
+    if encoder is None:
+        # sentence-transformers is only required when the semantic cache is enabled
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "The semantic cache requires sentence-transformers: pip install localaichat[semantic]"
+            )
+        with _encoders_lock:
+            encoder = _encoders.get(model_name)
+            if encoder is None:
+                encoder = _encoders[model_name] = SentenceTransformer(model_name)
+    return encoder
+
+
+def embed(text: str, model_name: str):
+    # Normalized embeddings turn cosine similarity into a plain dot product
+    return get_encoder(model_name).encode(
+        text, convert_to_numpy=True, normalize_embeddings=True
+    ).astype("float32", copy=False)
+
+
+class SemanticCache:
+    """Stores responses by prompt embedding and returns them for near-duplicate prompts.
+
+    Entries are kept in insertion order, so expired entries are always a prefix
+    of the cache and can be found with a bisect on their timestamps.
+    """
+
+    def __init__(
+        self, threshold: float = 0.92, ttl: Optional[float] = None, maxsize: int = 1024
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.M = None  # (maxsize, dim) float32 matrix, the first len(self) rows are live
+        self.entries: List[Tuple[bytes, Any]] = []  # (scope, response)
+        self.timestamps: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def drop(self, n: int) -> None:
+        # Drop the n oldest entries
+        size = len(self)
+        self.M[: size - n] = self.M[n:size]
+        del self.entries[:n]
+        del self.timestamps[:n]
+
+    def expire(self) -> None:
+        if self.ttl is None or not self.timestamps:
+            return
+        n = bisect.bisect_left(self.timestamps, time.monotonic() - self.ttl)
+        if n:
+            self.drop(n)
+
+    def get(self, scope: bytes, emb) -> Optional[Any]:
+        self.expire()
+        if not self.entries:
+            return None
+
+        import numpy as np
+
+        sims = self.M[: len(self)] @ emb
+        candidates = np.flatnonzero(sims > self.threshold)
+        for i in candidates[np.argsort(sims[candidates])[::-1]]:
+            entry_scope, response = self.entries[i]
+            if entry_scope == scope:
+                return response
+        return None
+
+    def add(self, scope: bytes, emb, response: Any) -> None:
+        import numpy as np
+
+        if self.M is None:
+            self.M = np.empty((self.maxsize, emb.shape[0]), dtype=np.float32)
+        self.expire()
+        if len(self) >= self.maxsize:
+            self.drop(len(self) - self.maxsize + 1)
+
+        self.M[len(self)] = emb / np.linalg.norm(emb)
+        self.entries.append((scope, response))
+        self.timestamps.append(time.monotonic())
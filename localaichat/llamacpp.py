@@ -46,7 +46,8 @@ class LlamaCppSession(ChatSession):
         else:
             user_message = ChatMessage(role="user", content=prompt)
 
-        gen_params = params or self.params
+        # Copy so functions are never written back into self.params or the caller's params
+        gen_params = dict(params) if params is not None else dict(self.params)
 
         if input_schema or output_schema:
             functions = []
@@ -200,8 +200,16 @@ class AIChat(BaseModel):
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
+        include_response: bool = None,
     ) -> str:
         sess = self.get_session(id)
+        # Only vLLM sessions make the cumulative response optional; the other
+        # backends always include it, so the flag is ignored for them
+        stream_kwargs = (
+            {"include_response": include_response}
+            if include_response is not None and isinstance(sess, vLLMSession)
+            else {}
+        )
         return sess.stream(
             prompt,
             client=self.client,
@@ -209,6 +217,7 @@ class AIChat(BaseModel):
             save_messages=save_messages,
             params=params,
             input_schema=input_schema,
+            **stream_kwargs,
         )
 
     def build_system(
@@ -293,6 +302,7 @@ class AIChat(BaseModel):
                     "prompt_length",
                     "completion_length",
                     "total_length",
+                    "cached_prompt_length",
                     "finish_reason",
                 ]
                 w = csv.DictWriter(f, fieldnames=fields)
@@ -362,6 +372,14 @@ class AIChat(BaseModel):
     def total_length(self, id: Union[str, UUID] = None) -> int:
         return self.message_totals("total_length", id)
 
+    @property
+    def total_cached_length(self, id: Union[str, UUID] = None) -> int:
+        return self.message_totals("total_cached_length", id)
+
+    @property
+    def cache_hit_rate(self, id: Union[str, UUID] = None) -> float:
+        return self.message_totals("cache_hit_rate", id)
+
     # alias total_tokens to total_length for common use
     @property
     def total_tokens(self, id: Union[str, UUID] = None) -> int:
@@ -418,11 +436,19 @@ class AsyncAIChat(AIChat):
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
+        include_response: bool = None,
     ) -> str:
         # TODO: move to a __post_init__ in Pydantic 2.0
         if isinstance(self.client, Client):
             self.client = AsyncClient(proxies=os.getenv("https_proxy"))
         sess = self.get_session(id)
+        # Only vLLM sessions make the cumulative response optional; the other
+        # backends always include it, so the flag is ignored for them
+        stream_kwargs = (
+            {"include_response": include_response}
+            if include_response is not None and isinstance(sess, vLLMSession)
+            else {}
+        )
         return sess.stream_async(
             prompt,
             client=self.client,
@@ -430,6 +456,7 @@ class AsyncAIChat(AIChat):
             save_messages=save_messages,
             params=params,
             input_schema=input_schema,
+            **stream_kwargs,
         )
 
     @asynccontextmanager
@@ -1,9 +1,10 @@
 import datetime
+import operator
 from typing import Any, Dict, List, Optional, Set, Union
 from uuid import UUID, uuid4
 
 import orjson
-from pydantic import BaseModel, Field, HttpUrl, SecretStr
+from pydantic import BaseModel, Field, HttpUrl, PrivateAttr, SecretStr
 
 
 def orjson_dumps(v, *, default, **kwargs):
@@ -27,11 +28,30 @@ class ChatMessage(BaseModel):
     prompt_length: Optional[int] = None
     completion_length: Optional[int] = None
     total_length: Optional[int] = None
+    cached_prompt_length: Optional[int] = None
 
     def __str__(self) -> str:
         return str(self.model_dump(exclude_none=True))
 
 
+class StreamResult:
+    """Accumulates streamed deltas, only decoding the full text when it is read."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self._text = None
+
+    def append(self, delta: str) -> None:
+        self.buffer.extend(delta.encode("utf-8"))
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.buffer.decode("utf-8")
+        return self._text
+
+
 class ChatSession(BaseModel):
     id: Union[str, UUID] = Field(default_factory=uuid4)
     created_at: datetime.datetime = Field(default_factory=now_tz)
@@ -47,7 +67,12 @@ class ChatSession(BaseModel):
     total_prompt_length: int = 0
     total_completion_length: int = 0
     total_length: int = 0
+    total_cached_length: int = 0
     title: Optional[str] = None
+    # Serialized copies of self.messages, so history isn't re-dumped on every
+    # request, and the message objects they were dumped from
+    _message_dicts: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+    _message_dicts_source: List[ChatMessage] = PrivateAttr(default_factory=list)
 
     def __str__(self) -> str:
         sess_start_str = self.created_at.strftime("%Y-%m-%d %H:%M:%S")
@@ -56,20 +81,44 @@ class ChatSession(BaseModel):
         - {len(self.messages):,} Messages
         - Last message sent at {last_message_str}"""
 
+    @property
+    def cache_hit_rate(self) -> float:
+        # Fraction of prompt tokens that were served from the server's prefix cache
+        return self.total_cached_length / max(self.total_prompt_length, 1)
+
+    def message_dicts(self) -> List[Dict[str, Any]]:
+        # A cached dict is reused only if the same message object is still at the
+        # same position, so replaced, inserted or deleted messages are re-dumped.
+        # Editing the fields of a message in place is not detected.
+        source = self._message_dicts_source
+        if len(source) == len(self.messages) and all(
+            map(operator.is_, source, self.messages)
+        ):
+            return self._message_dicts
+
+        self._message_dicts = [
+            self._message_dicts[i]
+            if i < len(source) and source[i] is m
+            else m.model_dump(include=self.input_fields, exclude_none=True)
+            for i, m in enumerate(self.messages)
+        ]
+        self._message_dicts_source = list(self.messages)
+        return self._message_dicts
+
+    def recent_message_dicts(self) -> List[Dict[str, Any]]:
+        message_dicts = self.message_dicts()
+        return (
+            message_dicts[-self.recent_messages :]
+            if self.recent_messages
+            else message_dicts
+        )
+
     def format_input_messages(
         self, system_message: ChatMessage, user_message: ChatMessage
     ) -> list:
-        recent_messages = (
-            self.messages[-self.recent_messages :]
-            if self.recent_messages
-            else self.messages
-        )
         return (
             [system_message.model_dump(include=self.input_fields, exclude_none=True)]
-            + [
-                m.model_dump(include=self.input_fields, exclude_none=True)
-                for m in recent_messages
-            ]
+            + self.recent_message_dicts()
             + [user_message.model_dump(include=self.input_fields, exclude_none=True)]
         )
 
@@ -79,14 +128,13 @@ class ChatSession(BaseModel):
         assistant_message: ChatMessage,
         save_messages: bool = None,
     ) -> None:
-        # if save_messages is explicitly defined, always use that choice
-        # instead of the default
-        to_save = isinstance(save_messages, bool)
-
-        if to_save:
-            if save_messages:
-                self.messages.append(user_message)
-                self.messages.append(assistant_message)
-        elif self.save_messages:
+        if self.should_save_messages(save_messages):
             self.messages.append(user_message)
             self.messages.append(assistant_message)
+
+    def should_save_messages(self, save_messages: bool = None) -> bool:
+        # if save_messages is explicitly defined, always use that choice
+        # instead of the default
+        if isinstance(save_messages, bool):
+            return save_messages
+        return bool(self.save_messages)
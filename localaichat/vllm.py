@@ -1,16 +1,194 @@
-from typing import Any, Dict, List, Set, Union
+import asyncio
+import atexit
+import functools
+import hashlib
+import importlib.util
+import re
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 import orjson
-from httpx import AsyncClient, Client
-from pydantic import HttpUrl
+from httpx import AsyncClient, Client, Limits
+from pydantic import HttpUrl, PrivateAttr
 
-from .models import ChatMessage, ChatSession
+from .cache import SemanticCache, embed
+from .models import ChatMessage, ChatSession, StreamResult
 from .utils import remove_a_key
 
-tool_prompt = """From the list of tools below, reply ONLY with the name of the tool appropriate in response to the user's last message. If no tool is appropriate, reply with "no-function".
+# The tool prompt is static so it is an identical prefix for vLLM's prefix cache;
+# the tools, which can change between calls, are sent in the user message instead
+tool_prompt = """From the list of tools in the user's last message, reply ONLY with the name of the tool appropriate in response to the user's query. If no tool is appropriate, reply with "no-function"."""
 
-{tools}"""
+tool_query_prompt = """Tools:
+{tools}
 
+User query: {prompt}"""
+
+batch_prompt = """Answer each of the following {n} numbered messages separately. Reply ONLY with a numbered list containing one answer per message, in the same order, formatted as "1. <answer>".
+
+{prompts}"""
+
+batch_response_pattern = re.compile(r"^\s*(\d+)\.\s*", re.MULTILINE)
+
+
+def split_batch_response(response: str, n: int) -> Optional[List[str]]:
+    # Returns None if the model did not answer with exactly one item per prompt
+    parts = batch_response_pattern.split(response)
+    numbers = [int(number) for number in parts[1::2]]
+    if numbers != list(range(1, n + 1)):
+        return None
+    return [part.strip() for part in parts[2::2]]
+
+
+# Finds the (still JSON-escaped) delta content in a streamed chunk without parsing it
+delta_content_pattern = re.compile(rb'"content"\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
+
+
+def parse_delta(chunk: bytes) -> Optional[str]:
+    match = delta_content_pattern.search(chunk)
+    if match is None:
+        return orjson.loads(chunk)["choices"][0]["delta"].get("content")
+    content = match.group(1)
+    # Only escaped content needs an actual JSON decode
+    if b"\\" in content:
+        return orjson.loads(b'"' + content + b'"')
+    return content.decode("utf-8")
+
+
+class SSEDecoder:
+    """Splits streamed response bytes into the JSON payloads of SSE data lines."""
+
+    def __init__(self):
+        # Incomplete line left over from the previous read
+        self.tail = b""
+
+    def feed(self, raw: bytes) -> List[bytes]:
+        buffer = self.tail + raw if self.tail else raw
+        end = buffer.rfind(b"\n") + 1
+        self.tail = buffer[end:]
+        return self.parse(buffer[:end])
+
+    def flush(self) -> List[bytes]:
+        # The last line may not be newline-terminated
+        payloads = self.parse(self.tail)
+        self.tail = b""
+        return payloads
+
+    @staticmethod
+    def parse(lines: bytes) -> List[bytes]:
+        if b"\r" in lines:
+            lines = lines.replace(b"\r", b"")
+        # SSE JSON chunks are prepended with "data: ", the stream ends with "data: [DONE]"
+        return [
+            line[6:]
+            for line in lines.split(b"\n")
+            if line.startswith(b"data: ") and line != b"data: [DONE]"
+        ]
+
+
+def iter_sse(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    decoder = SSEDecoder()
+    for raw in chunks:
+        yield from decoder.feed(raw)
+    yield from decoder.flush()
+
+
+async def aiter_sse(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    decoder = SSEDecoder()
+    async for raw in chunks:
+        for payload in decoder.feed(raw):
+            yield payload
+    for payload in decoder.flush():
+        yield payload
+
+
+# Pydantic schema generation is deterministic per class, so it only needs to
+# happen once. Weak keys let dynamically created schemas be garbage collected.
+schema_cache: "weakref.WeakKeyDictionary[type, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def model_json_schema(schema: Any) -> Dict[str, Any]:
+    json_schema = schema_cache.get(schema)
+    if json_schema is None:
+        json_schema = schema_cache[schema] = schema.model_json_schema()
+    return json_schema
+
+
+# Shared keep-alive clients used when no client is passed, so repeated calls
+# reuse pooled connections instead of reconnecting to the server every time.
+# The sync client is closed at exit; call `await aclose_default_client()`
+# before the event loop shuts down to close the async one.
+default_client: Optional[Client] = None
+default_async_client: Optional[AsyncClient] = None
+default_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def default_client_kwargs() -> Dict[str, Any]:
+    return {
+        # HTTP/2 needs the optional h2 package: pip install localaichat[http2]
+        "http2": importlib.util.find_spec("h2") is not None,
+        "timeout": None,
+        "limits": Limits(max_keepalive_connections=64, max_connections=128),
+    }
+
+
+def get_client(is_async: bool) -> Union[Client, AsyncClient]:
+    global default_client, default_async_client, default_async_client_loop
+
+    if not is_async:
+        if default_client is None:
+            default_client = Client(**default_client_kwargs())
+            atexit.register(default_client.close)
+        return default_client
+
+    # An AsyncClient's connections belong to the event loop that opened them
+    loop = asyncio.get_running_loop()
+    if default_async_client is None or default_async_client_loop is not loop:
+        old_client, old_loop = default_async_client, default_async_client_loop
+        default_async_client = default_async_client_loop = None
+        # The old client can only be closed on its own loop. If that loop is
+        # running in another thread, close it there; otherwise (typically the
+        # loop was closed by asyncio.run) its connections are only released
+        # when the client is garbage collected.
+        if old_client is not None and old_loop.is_running() and not old_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(old_client.aclose(), old_loop)
+
+        default_async_client = AsyncClient(**default_client_kwargs())
+        default_async_client_loop = loop
+    return default_async_client
+
+
+async def aclose_default_client() -> None:
+    global default_async_client
+    if default_async_client is not None:
+        await default_async_client.aclose()
+        default_async_client = None
+
+
+def fail_futures(futures: List[asyncio.Future], e: BaseException) -> None:
+    for future in futures:
+        if not future.done():
+            future.set_exception(e)
+
+
+def fail_batch_items(items: List[Tuple], task: asyncio.Task) -> None:
+    # Callers must not wait forever if a batch fails unexpectedly
+    if task.cancelled():
+        fail_futures([item[-1] for item in items], asyncio.CancelledError())
+    elif task.exception() is not None:
+        fail_futures([item[-1] for item in items], task.exception())
+
+
+async def resolve_future(future: asyncio.Future, coro) -> None:
+    try:
+        result = await coro
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+    else:
+        if not future.done():
+            future.set_result(result)
 
 
 class vLLMSession(ChatSession):
@@ -18,6 +196,21 @@ class vLLMSession(ChatSession):
     input_fields: Set[str] = {"role", "content", "name"}
     system: str = "You are a helpful assistant."
     params: Dict[str, Any] = {"temperature": 0.3}
+    exact_cache_size: int = 1024
+    semantic_cache: bool = False
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_ttl: Optional[float] = 3600.0
+    semantic_cache_model: str = "all-MiniLM-L6-v2"
+    # Batched turns are saved without per-message token counts or finish_reason,
+    # since one request answers all of them; session totals are still updated
+    batch: bool = False
+    batch_size: int = 8
+    batch_window: float = 0.005
+    _exact_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _semantic_cache: Optional[SemanticCache] = PrivateAttr(default=None)
+    _batch_queue: Optional[asyncio.Queue] = PrivateAttr(default=None)
+    _batch_worker: Optional[asyncio.Task] = PrivateAttr(default=None)
+    _batch_tasks: Set[asyncio.Task] = PrivateAttr(default_factory=set)
 
     def prepare_request(
         self,
@@ -27,13 +220,16 @@ class vLLMSession(ChatSession):
         stream: bool = False,
         input_schema: Any = None,
         output_schema: Any = None,
+        followup_messages: List[ChatMessage] = None,
     ):
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.auth['api_key'].get_secret_value()}",
         }
 
-        system_message = ChatMessage(role="system", content=system or self.system)
+        # The request messages are plain dicts instead of dumped ChatMessages;
+        # only the user message is also a ChatMessage, since it may be saved
+        system_dict = {"role": "system", "content": system or self.system}
 
         # Handle regular prompts and "function calls" with guided_json
         if input_schema:
@@ -43,53 +239,159 @@ class vLLMSession(ChatSession):
                 content=prompt.model_dump_json(),
                 name=input_schema.__name__,
             )
+            user_dict = {
+                "role": "user",
+                "content": user_message.content,
+                "name": user_message.name,
+            }
         else:
             user_message = ChatMessage(role="user", content=prompt)
+            user_dict = {"role": "user", "content": user_message.content}
 
 
-        gen_params = params or self.params
+        # Copy so guided_json is never written back into self.params or the caller's params
+        gen_params = dict(params) if params is not None else dict(self.params)
         
         # vLLM doesn't natively support function calling, but it does support guided json
         # We will use guided json as a stand in for function calling
         if input_schema:
-            gen_params["guided_json"] = input_schema.model_json_schema()
+            gen_params["guided_json"] = model_json_schema(input_schema)
 
         if output_schema:
-            gen_params["guided_json"] = output_schema.model_json_schema()
+            gen_params["guided_json"] = model_json_schema(output_schema)
+
 
+        messages = [system_dict, *self.recent_message_dicts(), user_dict]
+
+        # Extra turns after the user prompt, e.g. tool context
+        if followup_messages:
+            messages += [
+                m.model_dump(include=self.input_fields, exclude_none=True)
+                for m in followup_messages
+            ]
 
         data = {
             "model": self.model,
-            "messages": self.format_input_messages(system_message, user_message),
+            "messages": messages,
             "stream": stream,
             **gen_params,
         }
 
         return headers, data, user_message
-    
+
+    def lookup_cache(self, data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Any]:
+        exact_key = None
+
+        # Greedy and guided_choice generations are deterministic, so identical
+        # requests can be answered without asking the server again
+        if self.exact_cache_size and (
+            data.get("temperature", 1.0) == 0.0 or "guided_choice" in data
+        ):
+            exact_key = hashlib.blake2b(
+                orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+            ).digest()
+            r = self._exact_cache.get(exact_key)
+            if r is not None:
+                self._exact_cache.move_to_end(exact_key)
+                return r, None
+
+        return None, (exact_key, None)
+
+    def semantic_cache_text(self, data: Dict[str, Any]) -> str:
+        # Only the system and user prompts are embedded
+        messages = data["messages"]
+        return f"{messages[0]['content']}\0{messages[-1]['content']}"
+
+    def lookup_semantic_cache(
+        self, data: Dict[str, Any], emb: Any, cache_key: Any
+    ) -> Tuple[Optional[Dict[str, Any]], Any]:
+        # The embedding is computed by the caller, so gen_async can keep the
+        # Sentence-BERT forward pass off the event loop
+        if self._semantic_cache is None:
+            self._semantic_cache = SemanticCache(
+                self.semantic_cache_threshold, self.semantic_cache_ttl
+            )
+
+        # Everything else that affects the generation (history, model and all
+        # generation params) must match exactly
+        scope = hashlib.blake2b(
+            orjson.dumps(
+                [
+                    data["messages"][1:-1],
+                    {
+                        key: value
+                        for key, value in data.items()
+                        if key not in ("messages", "stream")
+                    },
+                ],
+                option=orjson.OPT_SORT_KEYS,
+            )
+        ).digest()
+
+        r = self._semantic_cache.get(scope, emb)
+        if r is not None:
+            return r, None
+
+        exact_key, _ = cache_key
+        return None, (exact_key, (scope, emb))
+
+    def update_cache(self, cache_key: Any, r: Dict[str, Any]) -> None:
+        if cache_key is None or "choices" not in r:
+            return
+
+        # A cached response costs no tokens when it is served again
+        r = {**r, "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+        exact_key, semantic_key = cache_key
+        if exact_key is not None:
+            self._exact_cache[exact_key] = r
+            if len(self._exact_cache) > self.exact_cache_size:
+                self._exact_cache.popitem(last=False)
+        if semantic_key is not None:
+            self._semantic_cache.add(*semantic_key, r)
+
     def gen(
         self,
         prompt: str,
-        client: Union[Client, AsyncClient],
+        client: Optional[Union[Client, AsyncClient]] = None,
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        followup_messages: List[ChatMessage] = None,
     ):
+        client = client or get_client(is_async=False)
         headers, data, user_message = self.prepare_request(
-            prompt, system, params, False, input_schema, output_schema
+            prompt,
+            system,
+            params,
+            False,
+            input_schema,
+            output_schema,
+            followup_messages,
         )
 
-        r = client.post(
-            str(self.api_url),
-            json=data,
-            headers=headers,
-            timeout=None,
-        )
-        r = r.json()
+        r, cache_key = self.lookup_cache(data)
+        if r is None and self.semantic_cache:
+            emb = embed(self.semantic_cache_text(data), self.semantic_cache_model)
+            r, cache_key = self.lookup_semantic_cache(data, emb, cache_key)
+        if r is None:
+            r = client.post(
+                str(self.api_url),
+                content=orjson.dumps(data),
+                headers=headers,
+                timeout=None,
+            )
+            r = orjson.loads(r.content)
+            self.update_cache(cache_key, r)
 
         try:
+            # Prompt tokens served from vLLM's prefix cache, if reported
+            cached_prompt_length = (
+                r["usage"].get("prompt_tokens_details") or {}
+            ).get("cached_tokens") or 0
+
             if not output_schema:
                 content = r["choices"][0]["message"]["content"]
                 assistant_message = ChatMessage(
@@ -99,6 +401,7 @@ class vLLMSession(ChatSession):
                     prompt_length=r["usage"]["prompt_tokens"],
                     completion_length=r["usage"]["completion_tokens"],
                     total_length=r["usage"]["total_tokens"],
+                    cached_prompt_length=cached_prompt_length,
                 )
                 self.add_messages(user_message, assistant_message, save_messages)
             else:
@@ -108,6 +411,7 @@ class vLLMSession(ChatSession):
             self.total_prompt_length += r["usage"]["prompt_tokens"]
             self.total_completion_length += r["usage"]["completion_tokens"]
             self.total_length += r["usage"]["total_tokens"]
+            self.total_cached_length += cached_prompt_length
         except KeyError:
             raise KeyError(f"No AI generation: {r}")
 
@@ -116,13 +420,15 @@ class vLLMSession(ChatSession):
     def stream(
         self,
         prompt: str,
-        client: Union[Client, AsyncClient],
+        client: Optional[Union[Client, AsyncClient]] = None,
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        include_response: bool = False,
     ):
+        client = client or get_client(is_async=False)
         headers, data, user_message = self.prepare_request(
             prompt, system, params, True, input_schema, output_schema
         )
@@ -130,25 +436,29 @@ class vLLMSession(ChatSession):
         with client.stream(
             "POST",
             str(self.api_url),
-            json=data,
+            content=orjson.dumps(data),
             headers=headers,
             timeout=None,
         ) as r:
-            content = []
-            for chunk in r.iter_lines():
-                if len(chunk) > 0:
-                    chunk = chunk[6:]  # SSE JSON chunks are prepended with "data: "
-                    if chunk != "[DONE]":
-                        chunk_dict = orjson.loads(chunk)
-                        delta = chunk_dict["choices"][0]["delta"].get("content")
-                        if delta:
-                            content.append(delta)
-                            yield {"delta": delta, "response": "".join(content)}
+            # The full response is only decoded when it is requested
+            result = StreamResult()
+            for chunk in iter_sse(r.iter_bytes()):
+                delta = parse_delta(chunk)
+                if delta:
+                    result.append(delta)
+                    if include_response:
+                        yield {"delta": delta, "response": result.text}
+                    else:
+                        yield {"delta": delta}
+
+        # Unsaved streams return the text without building an assistant message
+        if not self.should_save_messages(save_messages):
+            return result.text
 
         # streaming does not currently return token counts
         assistant_message = ChatMessage(
             role="assistant",
-            content="".join(content),
+            content=result.text,
         )
 
         self.add_messages(user_message, assistant_message, save_messages)
@@ -159,7 +469,7 @@ class vLLMSession(ChatSession):
         self,
         prompt: str,
         tools: List[Any],
-        client: Union[Client, AsyncClient],
+        client: Optional[Union[Client, AsyncClient]] = None,
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
@@ -167,18 +477,18 @@ class vLLMSession(ChatSession):
         
         # Call 1: Select the correct tool
         # vLLM supports guided choice, we can now directly pass in tool names
-        tool_names = [tool.__name__ for tool in tools]
-        tool_names.append("no-function")
+        tool_map = {tool.__name__: tool for tool in tools}
+        tool_names = [*tool_map, "no-function"]
 
-        # Add the list of tool names to the tool prompt
+        # Add the list of tool names to the user query
         tools_list = "\n".join(tool_names)
-        tool_prompt_format = tool_prompt.format(tools=tools_list)
+        tool_query = tool_query_prompt.format(tools=tools_list, prompt=prompt)
 
         # Use guided_choice to let the model select a tool
         tool_choice = self.gen(
-            prompt,
+            tool_query,
             client=client,
-            system=tool_prompt_format,
+            system=tool_prompt,
             save_messages=False,
             params={
                 "temperature": 0.0,
@@ -200,7 +510,7 @@ class vLLMSession(ChatSession):
             }
         
         # Execute the selected tool
-        selected_tool = next(tool for tool in tools if tool.__name__ == tool_choice)
+        selected_tool = tool_map[tool_choice]
         context_dict = selected_tool(prompt)
         if isinstance(context_dict, str):
             context_dict = {"context": context_dict}
@@ -208,16 +518,27 @@ class vLLMSession(ChatSession):
         context_dict["tool"] = selected_tool.__name__
 
         # Call 2: Incorporate the tool response into the model for a new generation
-        # This creates a temporary vLLMSession
-        new_system = f"{system or self.system}\n\nYou MUST use information from the context in your response."
-        new_prompt = f"Context: {context_dict['context']}\n\nUser: {prompt}"
+        # The system and user prompts are sent unchanged with the context as extra
+        # turns, so the request prefix matches a plain generation and can reuse
+        # vLLM's prefix cache
+        followup_messages = [
+            ChatMessage(
+                role="assistant",
+                content=f"Let me fetch context using {selected_tool.__name__}.",
+            ),
+            ChatMessage(
+                role="user",
+                content=f"Context: {context_dict['context']}\n\nYou MUST use information from the context in your response.",
+            ),
+        ]
 
         context_dict["response"] = self.gen(
-            new_prompt,
+            prompt,
             client=client,
-            system=new_system,
+            system=system,
             save_messages=False,
             params=params,
+            followup_messages=followup_messages,
         )
 
         # Manually append the nonmodified user message + normal AI response
@@ -232,26 +553,60 @@ class vLLMSession(ChatSession):
     async def gen_async(
         self,
         prompt: str,
-        client: Union[Client, AsyncClient],
+        client: Optional[Union[Client, AsyncClient]] = None,
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        followup_messages: List[ChatMessage] = None,
+        batch: bool = None,
+        return_messages: bool = False,
     ):
+        client = client or get_client(is_async=True)
+        # Guided generations constrain the whole output, so they can't be batched
+        if (self.batch if batch is None else batch) and not (
+            input_schema or output_schema or followup_messages or return_messages
+        ):
+            gen_params = params if params is not None else self.params
+            if not any(key.startswith("guided_") for key in gen_params):
+                return await self.submit_batch(
+                    prompt, client, system, save_messages, params
+                )
+
         headers, data, user_message = self.prepare_request(
-            prompt, system, params, False, input_schema, output_schema
+            prompt,
+            system,
+            params,
+            False,
+            input_schema,
+            output_schema,
+            followup_messages,
         )
 
-        r = await client.post(
-            str(self.api_url),
-            json=data,
-            headers=headers,
-            timeout=None,
-        )
-        r = r.json()
+        r, cache_key = self.lookup_cache(data)
+        if r is None and self.semantic_cache:
+            emb = await asyncio.get_running_loop().run_in_executor(
+                None, embed, self.semantic_cache_text(data), self.semantic_cache_model
+            )
+            r, cache_key = self.lookup_semantic_cache(data, emb, cache_key)
+        if r is None:
+            r = await client.post(
+                str(self.api_url),
+                content=orjson.dumps(data),
+                headers=headers,
+                timeout=None,
+            )
+            r = orjson.loads(r.content)
+            self.update_cache(cache_key, r)
 
+        assistant_message = None
         try:
+            # Prompt tokens served from vLLM's prefix cache, if reported
+            cached_prompt_length = (
+                r["usage"].get("prompt_tokens_details") or {}
+            ).get("cached_tokens") or 0
+
             if not output_schema:
                 content = r["choices"][0]["message"]["content"]
                 assistant_message = ChatMessage(
@@ -261,6 +616,7 @@ class vLLMSession(ChatSession):
                     prompt_length=r["usage"]["prompt_tokens"],
                     completion_length=r["usage"]["completion_tokens"],
                     total_length=r["usage"]["total_tokens"],
+                    cached_prompt_length=cached_prompt_length,
                 )
                 self.add_messages(user_message, assistant_message, save_messages)
             else:
@@ -270,21 +626,126 @@ class vLLMSession(ChatSession):
             self.total_prompt_length += r["usage"]["prompt_tokens"]
             self.total_completion_length += r["usage"]["completion_tokens"]
             self.total_length += r["usage"]["total_tokens"]
+            self.total_cached_length += cached_prompt_length
         except KeyError:
             raise KeyError(f"No AI generation: {r}")
 
+        # Lets callers save the messages themselves once they know they're needed
+        if return_messages:
+            return content, user_message, assistant_message
         return content
 
+    async def submit_batch(
+        self,
+        prompt: str,
+        client: AsyncClient,
+        system: str = None,
+        save_messages: bool = None,
+        params: Dict[str, Any] = None,
+    ) -> str:
+        # The worker is started lazily, and restarted if the event loop changed
+        loop = asyncio.get_running_loop()
+        if (
+            self._batch_worker is None
+            or self._batch_worker.done()
+            or self._batch_worker.get_loop() is not loop
+        ):
+            self._batch_queue = asyncio.Queue()
+            self._batch_worker = loop.create_task(self.batch_worker())
+
+        # Only requests sharing a client, system prompt and params can be combined.
+        # The key is built here so serialization errors reach the caller.
+        key = (id(client), system, orjson.dumps(params, option=orjson.OPT_SORT_KEYS))
+
+        future = loop.create_future()
+        self._batch_queue.put_nowait(
+            (key, (prompt, client, system, save_messages, params, future))
+        )
+        return await future
+
+    async def batch_worker(self) -> None:
+        while True:
+            # Wait for a request, then give others a short window to arrive
+            items = [await self._batch_queue.get()]
+            try:
+                await asyncio.sleep(self.batch_window)
+                while len(items) < self.batch_size and not self._batch_queue.empty():
+                    items.append(self._batch_queue.get_nowait())
+
+                groups = {}
+                for key, item in items:
+                    groups.setdefault(key, []).append(item)
+
+                for group in groups.values():
+                    task = asyncio.create_task(self.gen_batch(group))
+                    self._batch_tasks.add(task)
+                    task.add_done_callback(self._batch_tasks.discard)
+                    task.add_done_callback(
+                        functools.partial(fail_batch_items, group)
+                    )
+            except Exception as e:
+                # Keep the worker alive; fail only the requests taken in this round
+                fail_futures([item[-1] for _, item in items], e)
+
+    async def gen_batch(self, items: List[Tuple]) -> None:
+        _, client, system, _, params, _ = items[0]
+
+        responses = None
+        if len(items) > 1:
+            prompts = "\n".join(f"{i + 1}. {item[0]}" for i, item in enumerate(items))
+            try:
+                response = await self.gen_async(
+                    batch_prompt.format(n=len(items), prompts=prompts),
+                    client=client,
+                    system=system,
+                    save_messages=False,
+                    params=params,
+                    batch=False,
+                )
+            except Exception as e:
+                fail_futures([item[-1] for item in items], e)
+                return
+            responses = split_batch_response(response, len(items))
+
+        # If the model did not follow the numbered format, answer each prompt on its own
+        if responses is None:
+            await asyncio.gather(
+                *(
+                    resolve_future(
+                        future,
+                        self.gen_async(
+                            prompt,
+                            client=client,
+                            system=system,
+                            save_messages=save_messages,
+                            params=params,
+                            batch=False,
+                        ),
+                    )
+                    for prompt, _, _, save_messages, _, future in items
+                )
+            )
+            return
+
+        for (prompt, _, _, save_messages, _, future), response in zip(items, responses):
+            user_message = ChatMessage(role="user", content=prompt)
+            assistant_message = ChatMessage(role="assistant", content=response)
+            self.add_messages(user_message, assistant_message, save_messages)
+            if not future.done():
+                future.set_result(response)
+
     async def stream_async(
         self,
         prompt: str,
-        client: Union[Client, AsyncClient],
+        client: Optional[Union[Client, AsyncClient]] = None,
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
         input_schema: Any = None,
         output_schema: Any = None,
+        include_response: bool = False,
     ):
+        client = client or get_client(is_async=True)
         headers, data, user_message = self.prepare_request(
             prompt, system, params, True, input_schema, output_schema
         )
@@ -292,25 +753,29 @@ class vLLMSession(ChatSession):
         async with client.stream(
             "POST",
             str(self.api_url),
-            json=data,
+            content=orjson.dumps(data),
             headers=headers,
             timeout=None,
         ) as r:
-            content = []
-            async for chunk in r.aiter_lines():
-                if len(chunk) > 0:
-                    chunk = chunk[6:]  # SSE JSON chunks are prepended with "data: "
-                    if chunk != "[DONE]":
-                        chunk_dict = orjson.loads(chunk)
-                        delta = chunk_dict["choices"][0]["delta"].get("content")
-                        if delta:
-                            content.append(delta)
-                            yield {"delta": delta, "response": "".join(content)}
+            # The full response is only decoded when it is requested
+            result = StreamResult()
+            async for chunk in aiter_sse(r.aiter_bytes()):
+                delta = parse_delta(chunk)
+                if delta:
+                    result.append(delta)
+                    if include_response:
+                        yield {"delta": delta, "response": result.text}
+                    else:
+                        yield {"delta": delta}
+
+        # Unsaved streams don't need an assistant message
+        if not self.should_save_messages(save_messages):
+            return
 
         # streaming does not currently return token counts
         assistant_message = ChatMessage(
             role="assistant",
-            content="".join(content),
+            content=result.text,
         )
 
         self.add_messages(user_message, assistant_message, save_messages)
@@ -321,35 +786,65 @@ class vLLMSession(ChatSession):
         self,
         prompt: str,
         tools: List[Any],
-        client: Union[Client, AsyncClient],
+        client: Optional[Union[Client, AsyncClient]] = None,
         system: str = None,
         save_messages: bool = None,
         params: Dict[str, Any] = None,
+        speculate: bool = True,
     ) -> Dict[str, Any]:
         
         # Call 1: Select the correct tool
         # vLLM supports guided choice, we can now directly pass in tool names
-        tool_names = [tool.__name__ for tool in tools]
-        tool_names.append("no-function")
+        tool_map = {tool.__name__: tool for tool in tools}
+        tool_names = [*tool_map, "no-function"]
 
-        # Add the list of tool names to the tool prompt
+        # Add the list of tool names to the user query
         tools_list = "\n".join(tool_names)
-        tool_prompt_format = tool_prompt.format(tools=tools_list)
+        tool_query = tool_query_prompt.format(tools=tools_list, prompt=prompt)
+
+        # Most prompts don't need a tool, so start the standard generation
+        # alongside the tool selection and discard it if a tool is chosen.
+        # Its messages are only saved once it is known to be used.
+        no_function_task = None
+        if speculate:
+            no_function_task = asyncio.create_task(
+                self.gen_async(
+                    prompt,
+                    client=client,
+                    system=system,
+                    save_messages=False,
+                    params=params,
+                    return_messages=True,
+                )
+            )
+            no_function_task.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
 
         # Use guided_choice to let the model select a tool
-        tool_choice = await self.gen_async(
-            prompt,
-            client=client,
-            system=tool_prompt_format,
-            save_messages=False,
-            params={
-                "temperature": 0.0,
-                "guided_choice": tool_names,
-            },
-        )
+        try:
+            tool_choice = await self.gen_async(
+                tool_query,
+                client=client,
+                system=tool_prompt,
+                save_messages=False,
+                params={
+                    "temperature": 0.0,
+                    "guided_choice": tool_names,
+                },
+            )
+        except BaseException:
+            if no_function_task is not None:
+                no_function_task.cancel()
+            raise
 
         # If no tool is selected, do a standard generation instead.
         if tool_choice == "no-function":
+            if no_function_task is not None:
+                response, user_message, assistant_message = await no_function_task
+                self.add_messages(user_message, assistant_message, save_messages)
+                return {"response": response, "tool": None}
+
             return {
                 "response": await self.gen_async(
                     prompt,
@@ -360,9 +855,12 @@ class vLLMSession(ChatSession):
                 ),
                 "tool": None,
             }
-        
+
+        if no_function_task is not None:
+            no_function_task.cancel()
+
         # Execute the selected tool
-        selected_tool = next(tool for tool in tools if tool.__name__ == tool_choice)
+        selected_tool = tool_map[tool_choice]
         context_dict = await selected_tool(prompt)
         if isinstance(context_dict, str):
             context_dict = {"context": context_dict}
@@ -370,16 +868,27 @@ class vLLMSession(ChatSession):
         context_dict["tool"] = selected_tool.__name__
 
         # Call 2: Incorporate the tool response into the model for a new generation
-        # This creates a temporary vLLMSession
-        new_system = f"{system or self.system}\n\nYou MUST use information from the context in your response."
-        new_prompt = f"Context: {context_dict['context']}\n\nUser: {prompt}"
+        # The system and user prompts are sent unchanged with the context as extra
+        # turns, so the request prefix matches a plain generation and can reuse
+        # vLLM's prefix cache
+        followup_messages = [
+            ChatMessage(
+                role="assistant",
+                content=f"Let me fetch context using {selected_tool.__name__}.",
+            ),
+            ChatMessage(
+                role="user",
+                content=f"Context: {context_dict['context']}\n\nYou MUST use information from the context in your response.",
+            ),
+        ]
 
         context_dict["response"] = await self.gen_async(
-            new_prompt,
+            prompt,
             client=client,
-            system=new_system,
+            system=system,
             save_messages=False,
             params=params,
+            followup_messages=followup_messages,
         )
 
         # Manually append the nonmodified user message + normal AI response
@@ -390,3 +899,60 @@ class vLLMSession(ChatSession):
         self.add_messages(user_message, assistant_message, save_messages)
 
         return context_dict
+
+    async def gen_with_tools_async_many(
+        self,
+        prompts: List[str],
+        tools: List[Any],
+        client: Optional[AsyncClient] = None,
+        system: str = None,
+        save_messages: bool = False,
+        params: Dict[str, Any] = None,
+        speculate: bool = True,
+        max_concurrent: int = 8,
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1.")
+
+        # Workers take the next prompt as soon as they are free, so a slow prompt
+        # only holds up its own worker. Results are yielded as (index, result)
+        # in the order they finish.
+        # Every prompt runs against this session's chat history. Turns are not
+        # saved by default so the prompts stay independent; with save_messages,
+        # each finished prompt is appended to the shared history that prompts
+        # still in flight may or may not see, in nondeterministic order.
+        pending = asyncio.Queue()
+        for item in enumerate(prompts):
+            pending.put_nowait(item)
+        finished = asyncio.Queue()
+
+        async def worker():
+            while not pending.empty():
+                i, prompt = pending.get_nowait()
+                try:
+                    result = await self.gen_with_tools_async(
+                        prompt,
+                        tools,
+                        client=client,
+                        system=system,
+                        save_messages=save_messages,
+                        params=params,
+                        speculate=speculate,
+                    )
+                except Exception as e:
+                    result = e
+                finished.put_nowait((i, result))
+
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(min(len(prompts), max_concurrent))
+        ]
+        try:
+            for _ in range(len(prompts)):
+                i, result = await finished.get()
+                if isinstance(result, Exception):
+                    raise result
+                yield i, result
+        finally:
+            for task in workers:
+                task.cancel()
@@ -26,4 +26,8 @@ setup(
         "rich>=13.4.1",
         "python-dateutil>=2.8.2",
     ],
+    extras_require={
+        "semantic": ["numpy", "sentence-transformers>=2.2.0"],
+        "http2": ["httpx[http2]"],
+    },
 )